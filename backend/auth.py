@@ -0,0 +1,31 @@
+from fastapi import HTTPException, Depends
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from cachetools import TTLCache
+import os
+import time
+import jwt
+
+# Environment variables for auth
+JWT_SECRET = os.getenv('JWT_SECRET', 'YOUR_JWT_SECRET')
+
+# Decode settings resolved once instead of per request
+JWT_SECRET_BYTES = JWT_SECRET.encode()
+_JWT_ALGORITHMS = ["HS256"]
+_JWT_OPTIONS = {'require': ['sub'], 'verify_signature': True, 'verify_exp': True}
+
+security = HTTPBearer()
+
+# Decoded payloads keyed by raw token; the TTL stays well below token lifetime
+_jwt_cache = TTLCache(maxsize=10_000, ttl=30)
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    token = credentials.credentials
+    payload = _jwt_cache.get(token)
+    if payload is not None and payload.get('exp', float('inf')) > time.time():
+        return payload
+    try:
+        payload = jwt.decode(token, JWT_SECRET_BYTES, algorithms=_JWT_ALGORITHMS, options=_JWT_OPTIONS)
+    except Exception:
+        raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+    _jwt_cache[token] = payload
+    return payload
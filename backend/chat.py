@@ -1,23 +1,57 @@
-from fastapi import APIRouter, HTTPException, Depends, Request, Query
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Depends, Request, Query
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 from typing import List, Optional
-from supabase import create_client, Client
 import os
-import jwt
-import requests
+import db
+from auth import get_current_user
+import httpx
+import hashlib
+import asyncio
+from cachetools import TTLCache
+from postgrest.exceptions import APIError
 from datetime import datetime
 
-# Environment variables for Supabase and Google Translate
-SUPABASE_URL = os.getenv('SUPABASE_URL', 'YOUR_SUPABASE_URL')
-SUPABASE_KEY = os.getenv('SUPABASE_KEY', 'YOUR_SUPABASE_SERVICE_ROLE_KEY')
-JWT_SECRET = os.getenv('JWT_SECRET', 'YOUR_JWT_SECRET')
+# Environment variables for Google Translate
 GOOGLE_TRANSLATE_API_KEY = os.getenv('GOOGLE_TRANSLATE_API_KEY', 'YOUR_GOOGLE_TRANSLATE_API_KEY')
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# One pooled client for Google Translate, created on startup; keeps TLS sessions alive
+# and multiplexes over HTTP/2
+_translate_client: Optional[httpx.AsyncClient] = None
 
-router = APIRouter()
-security = HTTPBearer()
+# preferred_language rarely changes, so keep it per process for a few minutes
+_lang_cache = TTLCache(maxsize=10_000, ttl=300)
+# Translations are stable per input; short chat phrases repeat a lot
+_translation_cache = TTLCache(maxsize=50_000, ttl=86400)
+
+# Concurrent translations are coalesced into one request. v2 allows up to 128 q values
+# and recommends at most 5,000 characters per request.
+TRANSLATE_PATH = '/language/translate/v2'
+TRANSLATE_BATCH_SIZE = 128
+TRANSLATE_BATCH_CHARS = 5000
+# Upper bound on waiting for a batched result (request timeout plus queueing slack)
+TRANSLATE_WAIT_TIMEOUT = 15.0
+_translate_queue: Optional[asyncio.Queue] = None
+_translate_tasks = set()
+
+MESSAGE_COLUMNS = 'id,sender_id,receiver_id,message,translated_message,timestamp'
+
+router = APIRouter(default_response_class=ORJSONResponse)
+
+# Started and stopped by the app lifespan in main.py
+async def start_translator():
+    global _translate_client, _translate_queue
+    _translate_client = _new_translate_client()
+    _translate_queue = asyncio.Queue()
+    _track_task(asyncio.create_task(_run_translate_batcher()))
+
+async def stop_translator():
+    global _translate_client, _translate_queue
+    _translate_queue = None
+    for task in list(_translate_tasks):
+        task.cancel()
+    await _translate_client.aclose()
+    _translate_client = None
 
 # --- Models ---
 class SendMessageRequest(BaseModel):
@@ -32,76 +66,170 @@ class Message(BaseModel):
     translated_message: Optional[str]
     timestamp: str
 
-# --- Auth helpers ---
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=["HS256"])
-        return payload
-    except Exception:
-        raise HTTPException(status_code=401, detail="Invalid authentication credentials")
-
-# --- Translation helper ---
-def translate_text(text, target_lang, source_lang=None):
-    url = f"https://translation.googleapis.com/language/translate/v2"
+# --- Conversation helpers ---
+def conversation_key(user_a, user_b):
+    # Same format as the messages.conversation_id column
+    return '_'.join(sorted((user_a, user_b)))
+
+# --- Profile helpers ---
+async def get_langs(user_ids):
+    langs = {}
+    for uid in user_ids:
+        # Single lookup: an entry can expire between a membership test and indexing
+        lang = _lang_cache.get(uid)
+        if lang is not None:
+            langs[uid] = lang
+    missing = [uid for uid in user_ids if uid not in langs]
+    if missing:
+        resp = await db.supabase.table('profiles').select('id,preferred_language').in_('id', missing).execute()
+        for row in resp.data:
+            langs[row['id']] = _lang_cache[row['id']] = row.get('preferred_language') or 'en'
+    return langs
+
+# --- Translation helpers ---
+def _track_task(task):
+    # Keep a reference so pending tasks are not garbage collected
+    _translate_tasks.add(task)
+    task.add_done_callback(_translate_tasks.discard)
+
+def _new_translate_client():
+    return httpx.AsyncClient(
+        base_url='https://translation.googleapis.com',
+        http2=True,
+        timeout=10.0,
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=100)
+    )
+
+async def _post_translations(client, texts, target_lang, source_lang=None):
     params = {
-        'q': text,
+        'q': texts,
         'target': target_lang,
         'key': GOOGLE_TRANSLATE_API_KEY
     }
     if source_lang:
         params['source'] = source_lang
-    resp = requests.post(url, data=params)
+    resp = await client.post(TRANSLATE_PATH, data=params)
     if resp.status_code == 200:
         data = resp.json()
-        return data['data']['translations'][0]['translatedText']
+        return [t['translatedText'] for t in data['data']['translations']]
     else:
-        return None
+        return [None] * len(texts)
+
+async def _translate_batch(target_lang, source_lang, items):
+    try:
+        translations = await _post_translations(_translate_client, [text for text, _ in items], target_lang, source_lang)
+    except Exception as exc:
+        for _, future in items:
+            if not future.done():
+                future.set_exception(exc)
+        return
+    if len(translations) != len(items):
+        # A short or malformed response must not leave any caller waiting
+        translations = [None] * len(items)
+    for (_, future), translated in zip(items, translations):
+        if not future.done():
+            future.set_result(translated)
+
+async def _run_translate_batcher():
+    queue = _translate_queue
+    carry = None
+    while True:
+        batch = [carry if carry is not None else await queue.get()]
+        carry = None
+        chars = len(batch[0][0])
+        # Take only what is already waiting, so a lone translation is sent right away;
+        # an item that would exceed the size budget starts the next batch
+        while len(batch) < TRANSLATE_BATCH_SIZE and not queue.empty():
+            item = queue.get_nowait()
+            if chars + len(item[0]) > TRANSLATE_BATCH_CHARS:
+                carry = item
+                break
+            batch.append(item)
+            chars += len(item[0])
+        # One request per language pair
+        groups = {}
+        for text, target_lang, source_lang, future in batch:
+            groups.setdefault((target_lang, source_lang), []).append((text, future))
+        for (target_lang, source_lang), items in groups.items():
+            _track_task(asyncio.create_task(_translate_batch(target_lang, source_lang, items)))
+
+async def translate_text(text, target_lang, source_lang=None):
+    key = hashlib.sha1(f"{source_lang}|{target_lang}|{text}".encode()).hexdigest()
+    cached = _translation_cache.get(key)
+    if cached is not None:
+        return cached
+    if _translate_queue is None:
+        # Batcher not running (e.g. called outside the app), translate directly
+        async with _new_translate_client() as client:
+            translated = (await _post_translations(client, [text], target_lang, source_lang))[0]
+    else:
+        future = asyncio.get_running_loop().create_future()
+        _translate_queue.put_nowait((text, target_lang, source_lang, future))
+        translated = await asyncio.wait_for(future, TRANSLATE_WAIT_TIMEOUT)
+    if translated is not None:
+        _translation_cache[key] = translated
+    return translated
+
+async def _translate_and_update(message_id, message, source_lang, target_lang):
+    translated_message = await translate_text(message, target_lang, source_lang)
+    if translated_message is None:
+        return
+    # Clients receive the translation through Supabase Realtime row updates
+    await db.supabase.table('messages').update({
+        'translated_message': translated_message
+    }).eq('id', message_id).execute()
 
 # --- API Endpoints ---
 @router.post("/messages/send")
-def send_message(req: SendMessageRequest, user=Depends(get_current_user)):
+async def send_message(req: SendMessageRequest, background: BackgroundTasks,
+                       user=Depends(get_current_user)):
     sender_id = user['sub']
     receiver_id = req.receiver_id
     message = req.message
-    # Get sender and receiver preferred languages
-    sender_profile = supabase.table('profiles').select('preferred_language').eq('id', sender_id).single().execute().data
-    receiver_profile = supabase.table('profiles').select('preferred_language').eq('id', receiver_id).single().execute().data
-    sender_lang = sender_profile.get('preferred_language', 'en') if sender_profile else 'en'
-    receiver_lang = receiver_profile.get('preferred_language', 'en') if receiver_profile else 'en'
-    # Translate if needed
-    translated_message = None
-    if sender_lang != receiver_lang:
-        translated_message = translate_text(message, receiver_lang, sender_lang)
-    # Insert message into Supabase
-    insert_resp = supabase.table('messages').insert({
-        'sender_id': sender_id,
-        'receiver_id': receiver_id,
-        'message': message,
-        'translated_message': translated_message
-    }).execute()
-    if insert_resp.error:
+    # Get sender and receiver preferred languages; both are usually cached
+    sender_lang = _lang_cache.get(sender_id)
+    receiver_lang = _lang_cache.get(receiver_id)
+    if sender_lang is None or receiver_lang is None:
+        langs = await get_langs([sender_id, receiver_id])
+        sender_lang = langs.get(sender_id, 'en')
+        receiver_lang = langs.get(receiver_id, 'en')
+    # Insert message into Supabase; the translation is filled in afterwards
+    try:
+        insert_resp = await db.supabase.table('messages').insert({
+            'sender_id': sender_id,
+            'receiver_id': receiver_id,
+            'message': message,
+            'translated_message': None
+        }).execute()
+    except APIError:
         raise HTTPException(status_code=500, detail="Failed to send message")
+    # Same-language messages (the common case) never touch the translation path
+    if sender_lang != receiver_lang:
+        background.add_task(_translate_and_update, insert_resp.data[0]['id'], message, sender_lang, receiver_lang)
     return {"message": "Message sent"}
 
-@router.get("/messages/{conversation_id}", response_model=List[Message])
-def get_messages(conversation_id: str, user=Depends(get_current_user),
-                 limit: int = Query(50, ge=1, le=100),
-                 offset: int = Query(0, ge=0)):
+# Rows are returned as-is; Message is documented via responses=
+@router.get("/messages/{conversation_id}", responses={200: {"model": List[Message]}})
+async def get_messages(conversation_id: str, user=Depends(get_current_user),
+                       limit: int = Query(50, ge=1, le=100),
+                       before_id: Optional[int] = Query(None, ge=1)):
     # conversation_id is a string like "user1_user2" (sorted by id)
     user_ids = conversation_id.split('_')
     if len(user_ids) != 2:
         raise HTTPException(status_code=400, detail="Invalid conversation_id")
     if user['sub'] not in user_ids:
         raise HTTPException(status_code=403, detail="Forbidden")
-    # Fetch messages between the two users
-    query = supabase.table('messages').select('*') \
-        .or_(f"and(sender_id.eq.{user_ids[0]},receiver_id.eq.{user_ids[1]}),and(sender_id.eq.{user_ids[1]},receiver_id.eq.{user_ids[0]})") \
-        .order('timestamp', desc=False) \
-        .range(offset, offset + limit - 1)
-    resp = query.execute()
-    if resp.error:
+    conversation_id = conversation_key(*user_ids)
+    # Fetch the newest page of messages between the two users, older than before_id if given
+    query = db.supabase.table('messages').select(MESSAGE_COLUMNS).eq('conversation_id', conversation_id)
+    if before_id is not None:
+        query = query.lt('id', before_id)
+    try:
+        resp = await query.order('id', desc=True).limit(limit).execute()
+    except APIError:
         raise HTTPException(status_code=500, detail="Failed to fetch messages")
-    return resp.data
+    # Return the page oldest first; clients pass the first id as before_id to load older messages
+    return ORJSONResponse(resp.data[::-1])
 
 # --- Example SQL for Supabase schema ---
 # create table messages (
@@ -116,5 +244,14 @@ def get_messages(conversation_id: str, user=Depends(get_current_user),
 # create trigger set_message_timestamp before insert on messages
 # for each row execute procedure set_current_timestamp();
 #
+# -- one key per conversation regardless of direction, paginated by id
+# alter table messages add column conversation_id text generated always as (
+#   case when sender_id < receiver_id
+#     then sender_id::text || '_' || receiver_id::text
+#     else receiver_id::text || '_' || sender_id::text
+#   end
+# ) stored;
+# create index on messages (conversation_id, id desc);
+#
 # -- profiles table should have a preferred_language column
 # alter table profiles add column preferred_language text default 'en'; 
\ No newline at end of file
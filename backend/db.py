@@ -0,0 +1,16 @@
+from supabase import acreate_client, AsyncClient
+from typing import Optional
+import os
+
+# Environment variables for Supabase
+SUPABASE_URL = os.getenv('SUPABASE_URL', 'YOUR_SUPABASE_URL')
+SUPABASE_KEY = os.getenv('SUPABASE_KEY', 'YOUR_SUPABASE_SERVICE_ROLE_KEY')
+
+# Single client (and HTTP connection pool) shared by every router in the process.
+# Created on app startup; use it as `db.supabase` so the startup assignment is seen.
+supabase: Optional[AsyncClient] = None
+
+async def connect():
+    global supabase
+    if supabase is None:
+        supabase = await acreate_client(SUPABASE_URL, SUPABASE_KEY)
@@ -1,23 +1,19 @@
 from fastapi import APIRouter, HTTPException, Depends, Request
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 from typing import List
-from supabase import create_client, Client
-import os
-import jwt
+import db
+from auth import get_current_user
 from datetime import datetime
 
-# Environment variables for Supabase
-SUPABASE_URL = os.getenv('SUPABASE_URL', 'YOUR_SUPABASE_URL')
-SUPABASE_KEY = os.getenv('SUPABASE_KEY', 'YOUR_SUPABASE_SERVICE_ROLE_KEY')
-JWT_SECRET = os.getenv('JWT_SECRET', 'YOUR_JWT_SECRET')
-
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-
-router = APIRouter()
-security = HTTPBearer()
+router = APIRouter(default_response_class=ORJSONResponse)
 
 ORDER_STATUSES = ['Placed', 'Accepted', 'Out for Delivery', 'Delivered']
+PREVIOUS_STATUS = {ORDER_STATUSES[i + 1]: s for i, s in enumerate(ORDER_STATUSES[:-1])}
+
+# List responses leave out status_timestamps; it is served by the detail endpoint
+ORDER_LIST_COLUMNS = 'id,buyer_id,seller_id,status,created_at,items'
+ORDER_DETAIL_COLUMNS = 'id,buyer_id,seller_id,status,status_timestamps,created_at,items'
 
 # --- Models ---
 class OrderStatusUpdate(BaseModel):
@@ -35,75 +31,70 @@ class Order(BaseModel):
     buyer_id: str
     seller_id: str
     status: str
-    status_timestamps: dict
     created_at: str
     items: List[OrderItem]
 
-# --- Auth helpers ---
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=["HS256"])
-        return payload
-    except Exception:
-        raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+class OrderDetail(Order):
+    status_timestamps: dict
 
 # --- API Endpoints ---
-@router.get("/orders/{user_id}", response_model=List[Order])
-def get_orders(user_id: str, request: Request, user=Depends(get_current_user)):
+# Rows are returned as-is; Order is documented via responses=
+@router.get("/orders/{user_id}", responses={200: {"model": List[Order]}})
+async def get_orders(user_id: str, request: Request, user=Depends(get_current_user)):
     # Only allow access if user is the same as user_id or is a seller for those orders
     role = user.get('role')
     if user['sub'] != user_id and role != 'seller':
         raise HTTPException(status_code=403, detail="Forbidden")
-    # Fetch orders where user is buyer or seller
+    # Fetch orders where user is buyer or seller, with items aggregated by the view
     if role == 'buyer':
-        query = supabase.table('orders').select('*').eq('buyer_id', user_id)
+        query = db.supabase.table('orders_with_items').select(ORDER_LIST_COLUMNS).eq('buyer_id', user_id)
     elif role == 'seller':
-        query = supabase.table('orders').select('*').eq('seller_id', user_id)
+        query = db.supabase.table('orders_with_items').select(ORDER_LIST_COLUMNS).eq('seller_id', user_id)
     else:
         raise HTTPException(status_code=403, detail="Invalid role")
-    orders_resp = query.execute()
-    if not orders_resp.data:
-        return []
-    orders = orders_resp.data
-    # Fetch order items for each order
-    order_ids = [o['id'] for o in orders]
-    items_resp = supabase.table('order_items').select('*').in_('order_id', order_ids).execute()
-    items_by_order = {}
-    for item in items_resp.data:
-        items_by_order.setdefault(item['order_id'], []).append(item)
-    # Attach items to orders
-    for o in orders:
-        o['items'] = items_by_order.get(o['id'], [])
-    return orders
+    orders_resp = await query.execute()
+    return ORJSONResponse(orders_resp.data or [])
+
+@router.get("/orders/{order_id}/details", response_model=OrderDetail)
+async def get_order_details(order_id: int, user=Depends(get_current_user)):
+    order_resp = await db.supabase.table('orders_with_items').select(ORDER_DETAIL_COLUMNS) \
+        .eq('id', order_id).execute()
+    if not order_resp.data:
+        raise HTTPException(status_code=404, detail="Order not found")
+    order = order_resp.data[0]
+    # Only the buyer or seller of the order can see it
+    if user['sub'] not in (order['buyer_id'], order['seller_id']):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return order
 
 @router.post("/orders/{order_id}/status")
-def update_order_status(order_id: int, status_update: OrderStatusUpdate, user=Depends(get_current_user)):
+async def update_order_status(order_id: int, status_update: OrderStatusUpdate, user=Depends(get_current_user)):
     # Only sellers can update status
     if user.get('role') != 'seller':
         raise HTTPException(status_code=403, detail="Only sellers can update order status")
-    # Fetch order
-    order_resp = supabase.table('orders').select('*').eq('id', order_id).single().execute()
-    order = order_resp.data
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-    if order['seller_id'] != user['sub']:
-        raise HTTPException(status_code=403, detail="You can only update your own orders")
     # Validate status transition
-    current_status = order['status']
     new_status = status_update.new_status
-    if new_status not in ORDER_STATUSES:
-        raise HTTPException(status_code=400, detail="Invalid status")
-    if ORDER_STATUSES.index(new_status) != ORDER_STATUSES.index(current_status) + 1:
+    expected_status = PREVIOUS_STATUS.get(new_status)
+    if expected_status is None:
+        if new_status not in ORDER_STATUSES:
+            raise HTTPException(status_code=400, detail="Invalid status")
+        raise HTTPException(status_code=400, detail="Invalid status transition")
+    # Update status and timestamp only if the order is ours and still in the expected status
+    update_resp = await db.supabase.rpc('advance_order', {
+        'p_id': order_id,
+        'p_seller': user['sub'],
+        'p_expected_current': expected_status,
+        'p_new': new_status,
+        'p_changed_at': datetime.utcnow().isoformat()
+    }).execute()
+    if not update_resp.data:
+        # Nothing was updated; look the order up only to report why
+        order_resp = await db.supabase.table('orders').select('seller_id').eq('id', order_id).execute()
+        if not order_resp.data:
+            raise HTTPException(status_code=404, detail="Order not found")
+        if order_resp.data[0]['seller_id'] != user['sub']:
+            raise HTTPException(status_code=403, detail="You can only update your own orders")
         raise HTTPException(status_code=400, detail="Invalid status transition")
-    # Update status and timestamp
-    status_timestamps = order.get('status_timestamps') or {}
-    status_timestamps[new_status] = datetime.utcnow().isoformat()
-    update_resp = supabase.table('orders').update({
-        'status': new_status,
-        'status_timestamps': status_timestamps
-    }).eq('id', order_id).execute()
-    if update_resp.error:
-        raise HTTPException(status_code=500, detail="Failed to update order status")
     # (Optional) Push update to Supabase Realtime here
     return {"message": "Order status updated", "order_id": order_id, "new_status": new_status}
 
@@ -127,6 +118,27 @@ def update_order_status(order_id: int, status_update: OrderStatusUpdate, user=De
 #   price numeric
 # );
 #
+# create index on order_items (order_id);
+#
+# -- advances an order by one status in a single statement, read by update_order_status --
+# create function advance_order(p_id bigint, p_seller uuid, p_expected_current text,
+#                               p_new text, p_changed_at text)
+# returns setof orders language sql as $$
+#   update orders
+#   set status = p_new,
+#       status_timestamps = coalesce(status_timestamps, '{}'::jsonb) || jsonb_build_object(p_new, p_changed_at)
+#   where id = p_id and seller_id = p_seller and status = p_expected_current
+#   returning *;
+# $$;
+#
+# -- orders with their items as a jsonb array, read by get_orders --
+# create view orders_with_items as
+# select o.*,
+#        coalesce(jsonb_agg(i.*) filter (where i.id is not null), '[]'::jsonb) as items
+# from orders o
+# left join order_items i on i.order_id = o.id
+# group by o.id;
+#
 # -- profiles table (example) --
 # create table profiles (
 #   id uuid primary key,